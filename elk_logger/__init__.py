@@ -2,13 +2,17 @@ from elk_logger.logger import (
     get_logger, 
     setup_logger, 
     truncate_large_data, 
-    get_extra_from_json
+    get_extra_from_json,
+    log_json,
+    configure_logstash_batching,
 )
 
 __all__ = [
     "get_logger", 
     "setup_logger", 
     "truncate_large_data", 
-    "get_extra_from_json"
+    "get_extra_from_json",
+    "log_json",
+    "configure_logstash_batching",
 ]
 __version__ = "0.1.0"
@@ -0,0 +1,79 @@
+# cython: language_level=3
+# Compiled counterpart of elk_logger.logger.truncate_large_data, same semantics.
+# Build in place with: cythonize -i elk_logger/_truncate.pyx
+# max_len stays a Python object so it is compared exactly like in the pure-Python version.
+
+from cpython.dict cimport PyDict_Check
+from cpython.list cimport PyList_Check
+from cpython.unicode cimport PyUnicode_Check, PyUnicode_GET_LENGTH
+
+
+cdef inline bint _is_container(object obj):
+    return PyDict_Check(obj) or PyList_Check(obj)
+
+
+cdef inline object _truncated(object value):
+    return f"<truncated: {PyUnicode_GET_LENGTH(value)} chars>"
+
+
+cdef inline object _iter_items(object container):
+    return iter(container.items()) if PyDict_Check(container) else enumerate(container)
+
+
+cdef inline object _shallow_copy(object container):
+    return dict(container) if PyDict_Check(container) else list(container)
+
+
+cdef bint _has_long(object obj, object max_len):
+    cdef list stack = [obj]
+    cdef set seen = {id(obj)}
+    cdef object container, value
+    while stack:
+        container = stack.pop()
+        for value in (container.values() if PyDict_Check(container) else container):
+            if PyUnicode_Check(value):
+                if PyUnicode_GET_LENGTH(value) > max_len:
+                    return True
+            elif _is_container(value) and id(value) not in seen:
+                seen.add(id(value))
+                stack.append(value)
+    return False
+
+
+cpdef object truncate_large_data(object obj, object max_len=100):
+    cdef list stack, frame, parent
+    cdef set active
+    cdef object key, value, result
+
+    if PyUnicode_Check(obj):
+        return _truncated(obj) if PyUnicode_GET_LENGTH(obj) > max_len else obj
+    if not _is_container(obj) or not _has_long(obj, max_len):
+        return obj
+
+    # A frame is [container, items iterator, copy or None, key of the child being walked].
+    stack = [[obj, _iter_items(obj), None, None]]
+    active = {id(obj)}
+    while True:
+        frame = stack[-1]
+        for key, value in frame[1]:
+            if PyUnicode_Check(value):
+                if PyUnicode_GET_LENGTH(value) > max_len:
+                    if frame[2] is None:
+                        frame[2] = _shallow_copy(frame[0])
+                    frame[2][key] = _truncated(value)
+            elif _is_container(value) and id(value) not in active:
+                frame[3] = key
+                stack.append([value, _iter_items(value), None, None])
+                active.add(id(value))
+                break
+        else:
+            stack.pop()
+            active.discard(id(frame[0]))
+            result = frame[0] if frame[2] is None else frame[2]
+            if not stack:
+                return result
+            if frame[2] is not None:
+                parent = stack[-1]
+                if parent[2] is None:
+                    parent[2] = _shallow_copy(parent[0])
+                parent[2][parent[3]] = result
@@ -1,55 +1,428 @@
+import copy
+import datetime
+import decimal
 import json
 import logging
+import logging.handlers
+import os
+import queue
 import sys
 import threading
+import uuid
+from collections import deque
 from typing import Any, Literal, Optional, List
 
+import logstash_async
+from logstash_async.constants import constants
 from logstash_async.formatter import LogstashFormatter
 from logstash_async.handler import AsynchronousLogstashHandler
+from logstash_async.transport import TcpTransport
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 _loggers = {}
+_logstash_handlers = {}
 _lock = threading.Lock()
 
+try:
+    _IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 1024
+if _IOV_MAX <= 0:
+    _IOV_MAX = 1024
+
+_RESET_COLOR = "\033[0m"
+_LEVEL_COLORS = {
+    logging.DEBUG: "\033[36m",
+    logging.INFO: "\033[32m",
+    logging.WARNING: "\033[33m",
+    logging.ERROR: "\033[31m",
+    logging.CRITICAL: "\033[1;31m",
+}
+
+
+def _decode_bytes(value: bytes) -> str:
+    return value.decode('utf-8', 'replace')
+
+
+class RawJSON(str):
+    """A string that already holds serialized JSON."""
+
 
 class SafeLogstashFormatter(LogstashFormatter):
+    def __init__(self, *args, embed_raw_json: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._embed_raw_json = embed_raw_json
+        self._raw_json_placeholder = f"__raw_json_{uuid.uuid4().hex}_"
+        self._prepare_static_fields()
+        # record fields go through _value_repr, which the library ends with repr(),
+        # these types get a proper JSON value instead of "Decimal('1.5')" or "b'..'"
+        self._value_converters = {
+            decimal.Decimal: str,
+            frozenset: lambda v: [self._value_repr(item) for item in v],
+            bytes: _decode_bytes,
+        }
+        # static extras, metadata and tags skip _value_repr and reach the encoder as they are
+        self._json_dispatch = {
+            datetime.datetime: datetime.datetime.isoformat,
+            datetime.date: datetime.date.isoformat,
+            uuid.UUID: str,
+            decimal.Decimal: str,
+            set: list,
+            frozenset: list,
+            bytes: _decode_bytes,
+        }
+
+    def _prepare_static_fields(self):
+        # Everything that does not depend on the record is resolved once here, _format_to_dict
+        # then only adds the per-record values. Setups the shortcut does not cover (no extra
+        # prefix, customized skip or top-level field lists) go through the generic path.
+        schema = self.MessageSchema
+        skip = self.field_skip_set
+        top_level = self.top_level_field_set | {self._extra_prefix}
+        primary_fields = {
+            schema.VERSION: '1',
+            schema.HOST: self._host,
+            schema.LOG_SOURCE: self._logsource,
+            schema.PROGRAM: self._program_name,
+            schema.MESSAGE_TYPE: self._message_type,
+        }
+        if self._metadata:
+            primary_fields[schema.METADATA] = self._metadata
+        if self._tags:
+            primary_fields[schema.TAGS] = self._tags
+        dynamic_primary = (schema.TIMESTAMP, schema.LOG_LEVEL, schema.MESSAGE, schema.PID)
+        dynamic_extra = (
+            schema.FUNC_NAME, schema.LINE, schema.LOGGER_NAME, schema.PATH,
+            schema.PROCESS_NAME, schema.THREAD_NAME, schema.TASK_NAME,
+            schema.ERROR_TYPE, schema.STACK_TRACE,
+        )
+        self._specialized = (
+            bool(self._extra_prefix)
+            and all(k in top_level and k not in skip for k in (*primary_fields, *dynamic_primary))
+            and not any(k in top_level or k in skip for k in dynamic_extra)
+        )
+
+        static_extra = {
+            schema.INTERPRETER: self._interpreter,
+            schema.INTERPRETER_VERSION: self._interpreter_version,
+            schema.LOGSTASH_ASYNC_VERSION: logstash_async.__version__,
+            **(self._extra or {}),
+        }
+        self._top_level_fields = top_level
+        self._static_primary_fields = primary_fields
+        self._static_top_fields = {
+            k: v for k, v in static_extra.items() if k in top_level and k not in skip
+        }
+        self._static_extra_fields = {
+            k: v for k, v in static_extra.items() if k not in top_level and k not in skip
+        }
+
+    def _format_to_dict(self, record: logging.LogRecord) -> dict:
+        # a record attribute named like the prefix is merged with the extras by the library
+        if not self._specialized or self._extra_prefix in record.__dict__:
+            return super()._format_to_dict(record)
+
+        schema = self.MessageSchema
+        message = {
+            schema.TIMESTAMP: self._format_timestamp(record.created),
+            schema.LOG_LEVEL: record.levelname,
+            schema.MESSAGE: record.getMessage(),
+            schema.PID: record.process,
+            **self._static_primary_fields,
+        }
+        extra = {}
+        skip = self.field_skip_set
+        top_level = self._top_level_fields
+        value_repr = self._value_repr
+        for key, value in record.__dict__.items():
+            if key in skip:
+                continue
+            if key in top_level:
+                message[key] = value_repr(value)
+            else:
+                extra[key] = value_repr(value)
+
+        extra[schema.FUNC_NAME] = record.funcName
+        extra[schema.LINE] = record.lineno
+        extra[schema.LOGGER_NAME] = record.name
+        extra[schema.PATH] = record.pathname
+        extra[schema.PROCESS_NAME] = record.processName
+        extra[schema.THREAD_NAME] = record.threadName
+        message.update(self._static_top_fields)
+        extra.update(self._static_extra_fields)
+        if getattr(record, 'taskName', None):
+            extra[schema.TASK_NAME] = record.taskName
+        if record.exc_info:
+            extra[schema.ERROR_TYPE] = record.exc_info[0].__name__
+            extra[schema.STACK_TRACE] = self._format_exception(record.exc_info)
+
+        message[self._extra_prefix] = extra
+        return message
+
     def _serialize(self, message: dict) -> str:
+        if not self._embed_raw_json:
+            return self._dumps(message)
+
+        fragments = self._take_raw_json(message)
+        serialized = self._dumps(message)
+        for placeholder, fragment in fragments:
+            serialized = serialized.replace(f'"{placeholder}"', fragment, 1)
+        return serialized
+
+    def _take_raw_json(self, message: dict) -> list:
+        # RawJSON values sit at the top level or one level down in the extra prefix,
+        # swap them for placeholders and splice the fragments in after serializing
+        fragments = []
+        self._swap_raw_json(message, fragments)
+        for key, value in message.items():
+            if isinstance(value, dict) and any(isinstance(v, RawJSON) for v in value.values()):
+                # nested dicts may be shared with the formatter (e.g. metadata), swap in a copy
+                value = dict(value)
+                self._swap_raw_json(value, fragments)
+                message[key] = value
+        return fragments
+
+    def _swap_raw_json(self, fields: dict, fragments: list):
+        for key, value in fields.items():
+            if isinstance(value, RawJSON):
+                placeholder = f"{self._raw_json_placeholder}{len(fragments)}"
+                fields[key] = placeholder
+                # newlines can only be indentation in valid JSON, events must stay one line
+                if "\n" in value:
+                    value = value.replace("\n", "")
+                fragments.append((placeholder, value))
+
+    def _dumps(self, message: dict) -> str:
+        if orjson is not None:
+            try:
+                return orjson.dumps(
+                    message,
+                    default=self._json_default,
+                    option=orjson.OPT_NON_STR_KEYS,
+                ).decode()
+            except orjson.JSONEncodeError:
+                # e.g. integers beyond 64 bit, let the stdlib encoder handle those
+                pass
         return json.dumps(message, ensure_ascii=self._ensure_ascii, default=self._json_default)
     
-    def _json_default(self, obj: Any) -> str:
+    def _value_repr(self, value):
+        if isinstance(value, self._basic_data_types):
+            return value
+        converter = self._value_converters.get(type(value))
+        if converter is not None:
+            return converter(value)
+        return super()._value_repr(value)
+
+    def _json_default(self, obj: Any) -> Any:
+        converter = self._json_dispatch.get(type(obj))
+        if converter is not None:
+            return converter(obj)
         try:
             return str(obj)
         except Exception:
             return f"<non-serializable: {type(obj).__name__}>"
 
 
-class EnvironmentFilter(logging.Filter):
-    def __init__(self, environment: str):
-        super().__init__()
-        self.environment = environment
+class BatchedTcpTransport(TcpTransport):
+    def _send(self, events):
+        buffers = [self._convert_data_to_send(event) for event in events]
+        if self._ssl_enable or not hasattr(self._sock, "sendmsg"):
+            # one write for the whole batch instead of one per event
+            self._sock.sendall(b"".join(buffers))
+            return
+
+        # scatter-gather write, the kernel collects the events without joining them first
+        i = 0
+        while i < len(buffers):
+            sent = self._sock.sendmsg(buffers[i:i + _IOV_MAX])
+            while i < len(buffers) and sent >= len(buffers[i]):
+                sent -= len(buffers[i])
+                i += 1
+            if sent:
+                buffers[i] = memoryview(buffers[i])[sent:]
+
+
+class BatchedLogstashHandler(AsynchronousLogstashHandler):
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault("transport", BatchedTcpTransport)
+        super().__init__(*args, **kwargs)
+
+
+def configure_logstash_batching(max_batch_items: int = 500, flush_interval: Optional[float] = None):
+    """Set how many events are sent to Logstash per batch and how often batches are flushed.
+
+    This is process wide: logstash_async runs a single worker thread for all asynchronous
+    handlers, including ones not created by setup_logger, and reads these from its constants.
+    """
+    # flush as soon as a full batch is pending, each batch goes out over one connection
+    constants.QUEUED_EVENTS_BATCH_SIZE = max_batch_items
+    constants.QUEUED_EVENTS_FLUSH_COUNT = max_batch_items
+    if flush_interval is not None:
+        constants.QUEUED_EVENTS_FLUSH_INTERVAL = flush_interval
+
+
+class _BlockingQueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # the queue is bounded, wait for room instead of failing when it is full
+        self.queue.put(self._sentinel)
 
-    def filter(self, record):
-        record.environment = self.environment
-        return True
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    def __init__(
+        self,
+        handler: logging.Handler,
+        queue_size: int = 10000,
+        overflow_policy: Literal["block", "drop"] = "block",
+    ):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.handler = handler
+        self._queue_size = queue_size
+        self._block = overflow_policy == "block"
+        self._listener = None
+        # pid of the process the listener thread runs in, None while it is stopped
+        self._listener_pid = None
+
+    def _start_listener(self):
+        # formatting and serialization of records happen on the listener thread, not the caller's
+        self.queue = queue.Queue(maxsize=self._queue_size)
+        self._listener = _BlockingQueueListener(self.queue, self.handler, respect_handler_level=True)
+        self._listener.start()
+        self._listener_pid = os.getpid()
+
+    def emit(self, record):
+        # Started on first use and restarted after close() (the handler may be shared by
+        # several loggers) or in a forked child, which does not inherit the thread.
+        # Runs with the handler lock held, so only one thread starts it.
+        if self._listener_pid != os.getpid():
+            self._start_listener()
+        super().emit(record)
+
+    def prepare(self, record):
+        # The message is resolved now, the caller may mutate its args afterwards.
+        # Unlike QueueHandler.prepare nothing is formatted here and exc_info is kept,
+        # the Logstash formatter needs it for error_type and stack_trace.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        if not self._block:
+            try:
+                self.queue.put_nowait(record)
+            except queue.Full:
+                pass  # dropped according to the overflow policy
+            return
+
+        # wait for room, but give up once the listener is stopped, nothing would make room then
+        pending = self.queue
+        while self._listener_pid == os.getpid():
+            try:
+                pending.put(record, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def flush(self):
+        if self._listener_pid == os.getpid():
+            self.queue.join()
+        self.handler.flush()
+
+    def close(self):
+        listener = self._listener
+        if self._listener_pid == os.getpid():
+            self._listener_pid = None
+            listener.stop()
+        self.handler.close()
+        super().close()
 
 
 class ConsoleFormatterWithExtra(logging.Formatter):
-    def __init__(self, fmt=None, datefmt=None, style='%', allowed_fields=None):
+    def __init__(self, fmt=None, datefmt=None, style='%', allowed_fields=None, colored=False):
         super().__init__(fmt, datefmt, style)
         self.allowed_fields = allowed_fields if allowed_fields is not None else ['raw_json']
+        # one style per level with the ANSI codes already baked into the format string
+        self._styles_by_level = {
+            levelno: type(self._style)(f"{color}{self._style._fmt}{_RESET_COLOR}")
+            for levelno, color in _LEVEL_COLORS.items()
+        } if colored else {}
+
+    @property
+    def allowed_fields(self):
+        return self._allowed_fields
+
+    @allowed_fields.setter
+    def allowed_fields(self, value):
+        self._allowed_fields = value
+        # deduplicated, but ordered so the extra fields always print in the same order
+        self._allowed = tuple(dict.fromkeys(value))
+
+    def formatMessage(self, record):
+        return self._styles_by_level.get(record.levelno, self._style).format(record)
     
     def format(self, record):
         base_msg = super().format(record)
         
-        extra_fields = {
-            k: v for k, v in record.__dict__.items()
-            if k in self.allowed_fields
-        }
-        
-        if extra_fields:
-            extra_str = ' '.join(f'{k}={v}' for k, v in extra_fields.items())
-            return f"{base_msg} | {extra_str}"
-        return base_msg
+        d = record.__dict__
+        parts = [(k, d[k]) for k in self._allowed if k in d]
+        if not parts:
+            return base_msg
+        return f"{base_msg} | {' '.join(f'{k}={v}' for k, v in parts)}"
+
+
+def _get_logstash_handler(
+    host: str,
+    port: int,
+    level: int,
+    environment: str,
+    project_name: Optional[str],
+    queue_size: int,
+    overflow_policy: Literal["block", "drop"],
+    embed_raw_json: bool,
+) -> logging.Handler:
+    # loggers with the same logstash settings share one handler (and its queue thread),
+    # closing it through one of them is fine, the next record restarts the thread;
+    # called with _lock held
+    key = (
+        host, port, level, environment, project_name,
+        queue_size, overflow_policy, embed_raw_json,
+    )
+    handler = _logstash_handlers.get(key)
+    if handler is not None:
+        return handler
+
+    logstash_handler = BatchedLogstashHandler(
+        host=host,
+        port=port,
+        database_path=None,
+    )
+    if project_name:
+        formatter = SafeLogstashFormatter(
+            message_type=project_name,
+            extra_prefix=project_name,
+            extra={"environment": environment},
+            embed_raw_json=embed_raw_json,
+        )
+    else:
+        formatter = SafeLogstashFormatter(
+            extra={"environment": environment},
+            embed_raw_json=embed_raw_json,
+        )
+    logstash_handler.setFormatter(formatter)
+    logstash_handler.setLevel(level)
+    handler = AsyncQueueHandler(
+        logstash_handler,
+        queue_size=queue_size,
+        overflow_policy=overflow_policy,
+    )
+    handler.setLevel(level)
+    _logstash_handlers[key] = handler
+    return handler
 
 
 def setup_logger(
@@ -62,7 +435,16 @@ def setup_logger(
     environment: Literal["dev", "prod", "staging", "test"] = "prod",
     project_name: Optional[str] = None,
     stdout_extra_fields: Optional[List[str]] = None,
+    stdout_colors: bool = False,
+    logstash_queue_size: int = 10000,
+    logstash_overflow_policy: Literal["block", "drop"] = "block",
+    logstash_embed_raw_json: bool = False,
 ) -> logging.Logger:
+    # dict reads are atomic, the lock is only needed to build a new logger
+    existing = _loggers.get(name)
+    if existing is not None:
+        return existing
+
     with _lock:
         if name in _loggers:
             return _loggers[name]
@@ -71,42 +453,40 @@ def setup_logger(
         logger.setLevel(level)
         logger.propagate = False
 
-        if logger.hasHandlers():
-            logger.handlers.clear()
-
-        env_filter = EnvironmentFilter(environment)
-        logger.addFilter(env_filter)
+        # only names missing from _loggers get here, drop handlers attached outside setup_logger
+        logger.handlers.clear()
 
         if enable_stdout:
             console_handler = logging.StreamHandler(sys.stdout)
             console_handler.setLevel(level)
             console_formatter = ConsoleFormatterWithExtra(
-                fmt="[%(asctime)s][%(name)s][%(levelname)s][%(environment)s] %(message)s",
+                # the environment is fixed per logger, so it is part of the format itself
+                fmt=(
+                    "[%(asctime)s][%(name)s][%(levelname)s]"
+                    f"[{environment.replace('%', '%%')}] %(message)s"
+                ),
                 datefmt="%m/%d/%Y %H:%M:%S",
                 allowed_fields=(
                     stdout_extra_fields 
                     if stdout_extra_fields is not None else 
                     ['raw_json']
                 ),
+                colored=stdout_colors,
             )
             console_handler.setFormatter(console_formatter)
             logger.addHandler(console_handler)
 
         if enable_logstash and logstash_host:
-            logstash_handler = AsynchronousLogstashHandler(
+            logstash_handler = _get_logstash_handler(
                 host=logstash_host,
                 port=logstash_port,
-                database_path=None,
+                level=level,
+                environment=environment,
+                project_name=project_name,
+                queue_size=logstash_queue_size,
+                overflow_policy=logstash_overflow_policy,
+                embed_raw_json=logstash_embed_raw_json,
             )
-            if project_name:
-                logstash_handler.setFormatter(
-                    SafeLogstashFormatter(
-                        message_type=project_name,
-                        extra_prefix=project_name,
-                        extra={"environment": environment},
-                    )
-                )
-            logstash_handler.setLevel(level)
             logger.addHandler(logstash_handler)
 
         _loggers[name] = logger
@@ -114,23 +494,114 @@ def setup_logger(
 
 
 def get_logger(name: str) -> logging.Logger:
-    with _lock:
-        if name in _loggers:
-            return _loggers[name]
+    existing = _loggers.get(name)
+    if existing is not None:
+        return existing
     return setup_logger(name)
 
 
+def _iter_items(container):
+    return iter(container.items()) if isinstance(container, dict) else enumerate(container)
+
+
+def _shallow_copy(container):
+    return dict(container) if isinstance(container, dict) else list(container)
+
+
+def _has_long(obj, max_len):
+    # only answers whether anything needs truncating, no containers are created on the way
+    str_, dict_, len_ = str, dict, len
+    containers = (dict, list)
+    stack = deque((obj,))
+    seen = {id(obj)}
+    while stack:
+        container = stack.pop()
+        for value in (container.values() if isinstance(container, dict_) else container):
+            if isinstance(value, str_):
+                if len_(value) > max_len:
+                    return True
+            elif isinstance(value, containers) and id(value) not in seen:
+                seen.add(id(value))
+                stack.append(value)
+    return False
+
+
 def truncate_large_data(obj, max_len=100):
-    if isinstance(obj, dict):
-        return {k: truncate_large_data(v, max_len) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [truncate_large_data(item, max_len) for item in obj]
-    elif isinstance(obj, str) and len(obj) > max_len:
-        return f"<truncated: {len(obj)} chars>"
-    return obj
+    if isinstance(obj, str):
+        return f"<truncated: {len(obj)} chars>" if len(obj) > max_len else obj
+    if not isinstance(obj, (dict, list)) or not _has_long(obj, max_len):
+        return obj
+
+    # Containers are copied only when something beneath them gets truncated,
+    # untouched subtrees (and the common all-short payload) are returned as is.
+    # A frame is [container, items iterator, copy or None, key of the child being walked].
+    stack = [[obj, _iter_items(obj), None, None]]
+    active = {id(obj)}
+    while True:
+        frame = stack[-1]
+        for key, value in frame[1]:
+            if isinstance(value, str):
+                if len(value) > max_len:
+                    if frame[2] is None:
+                        frame[2] = _shallow_copy(frame[0])
+                    frame[2][key] = f"<truncated: {len(value)} chars>"
+            elif isinstance(value, (dict, list)) and id(value) not in active:
+                frame[3] = key
+                stack.append([value, _iter_items(value), None, None])
+                active.add(id(value))
+                break
+        else:
+            stack.pop()
+            active.discard(id(frame[0]))
+            result = frame[0] if frame[2] is None else frame[2]
+            if not stack:
+                return result
+            if frame[2] is not None:
+                parent = stack[-1]
+                if parent[2] is None:
+                    parent[2] = _shallow_copy(parent[0])
+                parent[2][parent[3]] = result
+
 
+try:
+    # optional compiled version, see _truncate.pyx
+    from elk_logger._truncate import truncate_large_data  # noqa: F811
+except ImportError:
+    pass
 
-def get_extra_from_json(data: dict, max_len: int = 100) -> dict:
+
+def get_extra_from_json(data: dict, max_len: int = 100, pretty: bool = False) -> dict:
+    data = truncate_large_data(data, max_len)
+    raw_json = None
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        try:
+            raw_json = orjson.dumps(data, option=option).decode()
+        except orjson.JSONEncodeError:
+            # e.g. integers beyond 64 bit, let the stdlib encoder handle those
+            pass
+    if raw_json is None:
+        if pretty:
+            raw_json = json.dumps(data, ensure_ascii=False, indent=2)
+        else:
+            raw_json = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
     return {
-        "raw_json": json.dumps(truncate_large_data(data, max_len), ensure_ascii=False, indent=2),
+        "raw_json": RawJSON(raw_json),
     }
+
+
+def log_json(
+    logger: logging.Logger,
+    level: int,
+    msg: str,
+    data: dict,
+    max_len: int = 100,
+    pretty: bool = False,
+    **kwargs,
+):
+    # truncating and serializing the payload is skipped for records the logger would drop
+    if not logger.isEnabledFor(level):
+        return
+    extra = kwargs.pop("extra", None) or {}
+    kwargs.setdefault("stacklevel", 2)
+    logger.log(level, msg, extra={**extra, **get_extra_from_json(data, max_len, pretty)}, **kwargs)
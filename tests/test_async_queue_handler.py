@@ -0,0 +1,107 @@
+import logging
+import os
+import threading
+import time
+
+import pytest
+
+from elk_logger.logger import AsyncQueueHandler
+
+
+class CollectingHandler(logging.Handler):
+    def __init__(self, delay=0.0):
+        super().__init__()
+        self.delay = delay
+        self.records = []
+
+    def emit(self, record):
+        time.sleep(self.delay)
+        self.records.append(record)
+
+
+def make_record(msg, *args):
+    return logging.LogRecord("test", logging.INFO, __file__, 1, msg, args, None)
+
+
+def test_message_is_resolved_when_enqueued():
+    target = CollectingHandler()
+    handler = AsyncQueueHandler(target)
+    state = {"n": 1}
+    handler.handle(make_record("n=%(n)s", state))
+    state["n"] = 2
+    handler.flush()
+    handler.close()
+
+    assert [r.getMessage() for r in target.records] == ["n=1"]
+
+
+def test_drop_policy_drops_when_queue_is_full():
+    target = CollectingHandler(delay=0.05)
+    handler = AsyncQueueHandler(target, queue_size=2, overflow_policy="drop")
+    for i in range(20):
+        handler.handle(make_record("record %s", i))
+    handler.flush()
+    handler.close()
+
+    assert 0 < len(target.records) < 20
+
+
+def test_flush_waits_for_queued_records():
+    target = CollectingHandler(delay=0.01)
+    handler = AsyncQueueHandler(target, queue_size=100)
+    for i in range(10):
+        handler.handle(make_record("record %s", i))
+    handler.flush()
+
+    assert len(target.records) == 10
+    handler.close()
+
+
+def test_close_delivers_queued_records_and_emit_restarts():
+    target = CollectingHandler()
+    handler = AsyncQueueHandler(target)
+    handler.handle(make_record("before close"))
+    handler.close()
+    assert [r.getMessage() for r in target.records] == ["before close"]
+
+    handler.handle(make_record("after close"))
+    handler.flush()
+    handler.close()
+    assert [r.getMessage() for r in target.records] == ["before close", "after close"]
+
+
+def test_blocked_writer_gives_up_after_close():
+    target = CollectingHandler(delay=0.1)
+    handler = AsyncQueueHandler(target, queue_size=1)
+    handler.handle(make_record("first"))
+
+    def fill():
+        for i in range(5):
+            handler.enqueue(make_record("record %s", i))
+
+    writer = threading.Thread(target=fill)
+    writer.start()
+    time.sleep(0.05)
+    handler.close()
+    writer.join(timeout=5)
+
+    assert not writer.is_alive()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs os.fork")
+def test_forked_child_restarts_listener():
+    target = CollectingHandler()
+    handler = AsyncQueueHandler(target, queue_size=5)
+    handler.handle(make_record("parent"))
+    handler.flush()
+
+    pid = os.fork()
+    if pid == 0:
+        for i in range(20):
+            handler.handle(make_record("child %s", i))
+        handler.flush()
+        os._exit(0 if len(target.records) == 21 else 1)
+
+    _, status = os.waitpid(pid, 0)
+    handler.close()
+    assert os.waitstatus_to_exitcode(status) == 0
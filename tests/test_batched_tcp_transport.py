@@ -0,0 +1,68 @@
+from elk_logger import logger
+from elk_logger.logger import BatchedTcpTransport
+
+
+class ShortWriteSocket:
+    """Accepts at most `limit` bytes per sendmsg call, like a full socket buffer."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.received = bytearray()
+        self.calls = []
+
+    def sendmsg(self, buffers):
+        buffers = [bytes(b) for b in buffers]
+        self.calls.append(len(buffers))
+        sent = b"".join(buffers)[:self.limit]
+        self.received += sent
+        return len(sent)
+
+
+class SendallSocket:
+    def __init__(self):
+        self.received = bytearray()
+
+    def sendall(self, data):
+        self.received += data
+
+
+def make_transport(sock, ssl_enable=False):
+    transport = BatchedTcpTransport(
+        host="localhost",
+        port=5959,
+        ssl_enable=ssl_enable,
+        ssl_verify=False,
+        ssl_verify_flags=None,
+        keyfile=None,
+        certfile=None,
+        ca_certs=None,
+    )
+    transport._sock = sock
+    return transport
+
+
+EVENTS = ["first event\n", "", "second\n", "third event, a bit longer\n", "x\n"]
+
+
+def test_short_writes_continue_where_they_stopped():
+    for limit in (1, 3, 7, 100):
+        sock = ShortWriteSocket(limit)
+        make_transport(sock)._send(list(EVENTS))
+
+        assert bytes(sock.received) == "".join(EVENTS).encode()
+
+
+def test_each_call_passes_at_most_iov_max_buffers(monkeypatch):
+    monkeypatch.setattr(logger, "_IOV_MAX", 2)
+    sock = ShortWriteSocket(1000)
+    make_transport(sock)._send(list(EVENTS))
+
+    assert bytes(sock.received) == "".join(EVENTS).encode()
+    assert max(sock.calls) == 2
+
+
+def test_ssl_sends_the_joined_batch():
+    sock = SendallSocket()
+    make_transport(sock, ssl_enable=True)._send(list(EVENTS))
+
+    assert bytes(sock.received) == "".join(EVENTS).encode()
@@ -0,0 +1,31 @@
+import logging
+
+from elk_logger import setup_logger
+
+
+class CollectingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_closing_a_shared_handler_keeps_other_loggers_working():
+    settings = dict(logstash_host="127.0.0.1", logstash_port=59591, enable_stdout=False)
+    first = setup_logger("pool-first", **settings)
+    second = setup_logger("pool-second", **settings)
+    (shared,) = first.handlers
+    assert second.handlers == [shared]
+
+    target = CollectingHandler()
+    shared.handler = target
+    first.info("before close")
+    for handler in first.handlers:
+        handler.close()
+    second.info("after close")
+    shared.flush()
+    shared.close()
+
+    assert [r.getMessage() for r in target.records] == ["before close", "after close"]
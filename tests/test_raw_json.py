@@ -0,0 +1,45 @@
+import json
+import logging
+
+from elk_logger.logger import RawJSON, SafeLogstashFormatter, get_extra_from_json
+
+
+def make_record(**extra):
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, "hello", None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_raw_json_is_embedded_as_json():
+    formatter = SafeLogstashFormatter(extra_prefix="app", embed_raw_json=True)
+    event = json.loads(formatter.format(make_record(**get_extra_from_json({"a": [1, 2]}))))
+
+    assert event["app"]["raw_json"] == {"a": [1, 2]}
+
+
+def test_pretty_fragment_stays_on_one_line():
+    formatter = SafeLogstashFormatter(extra_prefix="app", embed_raw_json=True)
+    data = {"a": {"b": "line\nbreak"}, "c": [1, 2]}
+    serialized = formatter.format(make_record(**get_extra_from_json(data, pretty=True)))
+
+    assert "\n" not in serialized
+    assert json.loads(serialized)["app"]["raw_json"] == data
+
+
+def test_shared_metadata_is_not_modified():
+    metadata = {"beat": "app", "raw": RawJSON('{"x": 1}')}
+    formatter = SafeLogstashFormatter(extra_prefix="app", metadata=metadata, embed_raw_json=True)
+
+    for _ in range(2):
+        event = json.loads(formatter.format(make_record(**get_extra_from_json({"n": 1}))))
+        assert event["@metadata"] == {"beat": "app", "raw": {"x": 1}}
+        assert event["app"]["raw_json"] == {"n": 1}
+    assert metadata == {"beat": "app", "raw": '{"x": 1}'}
+    assert isinstance(metadata["raw"], RawJSON)
+
+
+def test_raw_json_stays_a_string_when_not_embedded():
+    formatter = SafeLogstashFormatter(extra_prefix="app")
+    event = json.loads(formatter.format(make_record(**get_extra_from_json({"a": 1}))))
+
+    assert event["app"]["raw_json"] == '{"a":1}'